@@ -1 +1,2 @@
+from .bitmat import batched_bitmat, pack_ternary
 from .bitnetb158 import BitConv2db158, BitLinearb158
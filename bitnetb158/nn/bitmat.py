@@ -0,0 +1,471 @@
+from functools import lru_cache
+from itertools import product
+
+import torch
+import triton
+import triton.language as tl
+
+
+@lru_cache(maxsize=None)
+def _multi_processor_count(device_index):
+    return torch.cuda.get_device_properties(device_index).multi_processor_count
+
+
+def _bmm_autotune_configs():
+    """Tile configurations swept by `_ternary_bmm_kernel`'s autotuner.
+    Small tiles serve memory-bound skinny shapes (e.g. decode with m=1) and
+    large tiles serve compute-bound shapes; keying the autotuner on
+    ["m", "n", "k"] caches the best configuration per shape. The list is
+    curated rather than a cartesian product so a new shape tunes in seconds:
+    each tile appears once, with GROUP_SIZE_M / GROUP_AXIS variants only on
+    representative prefill and decode tiles.
+    """
+    variants = [
+        # (block_m, block_n, block_k, group_size, group_axis)
+        # compute-bound prefill / training tiles, grouped along M
+        (256, 128, 64, 8, 0),
+        (128, 256, 64, 8, 0),
+        (128, 128, 64, 1, 0),
+        (128, 128, 64, 8, 0),
+        (128, 128, 64, 16, 0),
+        (128, 128, 32, 8, 0),
+        (128, 64, 64, 8, 0),
+        (64, 128, 64, 8, 0),
+        (64, 64, 64, 4, 0),
+        # memory-bound skinny-M tiles; N-major grouping suits N >> M
+        (32, 256, 64, 4, 1),
+        (32, 128, 128, 4, 1),
+        (32, 128, 128, 8, 1),
+        (32, 64, 128, 4, 0),
+        (32, 64, 128, 4, 1),
+        (64, 32, 64, 4, 0),
+        (32, 32, 128, 4, 0),
+    ]
+    configs = []
+    for block_m, block_n, block_k, group_size, group_axis in variants:
+        tile = block_m * block_n
+        num_warps = 8 if tile >= 128 * 128 else 4 if tile >= 64 * 64 else 2
+        # pipeline the K loop deep enough to overlap global loads with
+        # tl.dot, dropping to 2 stages where shared memory gets tight
+        num_stages = 4 if tile >= 128 * 128 and block_k <= 64 else 3
+        if min(block_m, block_n) <= 32:
+            num_stages = 2
+        # every tile's pipelined blocks must fit in shared memory (one
+        # buffer per stage): A is int8 and B stays packed at 4 trits per
+        # byte, so the footprint is block_k * (block_m + block_n // 4)
+        assert block_k * (block_m + block_n // 4) * num_stages <= 96 * 1024
+        configs.append(
+            triton.Config(
+                {
+                    "BLOCK_SIZE_M": block_m,
+                    "BLOCK_SIZE_N": block_n,
+                    "BLOCK_SIZE_K": block_k,
+                    "GROUP_SIZE_M": group_size,
+                    "GROUP_AXIS": group_axis,
+                },
+                num_warps=num_warps,
+                num_stages=num_stages,
+            )
+        )
+    return configs
+
+
+@triton.jit
+def _unpack_trits(p):
+    # unpack all 4 lanes of each byte at once: 2-bit fields map
+    # 0b00 -> 0, 0b01 -> +1, 0b10 -> -1 (see pack_ternary), so
+    # (code & 1) - ((code >> 1) & 1) decodes a trit branchlessly and
+    # tl.interleave restores the K order l0, l1, l2, l3 per byte
+    p = p.to(tl.int8, bitcast=True)
+    l0 = (p & 1) - ((p >> 1) & 1)
+    l1 = ((p >> 2) & 1) - ((p >> 3) & 1)
+    l2 = ((p >> 4) & 1) - ((p >> 5) & 1)
+    l3 = ((p >> 6) & 1) - ((p >> 7) & 1)
+    return tl.interleave(tl.interleave(l0, l2), tl.interleave(l1, l3))
+
+
+@triton.autotune(configs=_bmm_autotune_configs(), key=["M", "N", "K"])
+@triton.jit
+def _ternary_bmm_kernel(
+    a_ptr,
+    b_ptr,
+    c_ptr,
+    B,
+    M,
+    N,
+    K,
+    stride_batch_a,
+    stride_am,
+    stride_ak,
+    stride_batch_b,
+    stride_bk,
+    stride_bn,
+    stride_batch_c,
+    stride_cm,
+    stride_cn,
+    scale_a_ptr,
+    scale_w_ptr,
+    N_BITS: tl.constexpr,
+    BLOCK_SIZE_M: tl.constexpr,
+    BLOCK_SIZE_N: tl.constexpr,
+    BLOCK_SIZE_K: tl.constexpr,
+    GROUP_SIZE_M: tl.constexpr,
+    GROUP_AXIS: tl.constexpr,
+    HAS_BATCH: tl.constexpr,
+):
+    start_pid = tl.program_id(axis=0)
+    num_pid_m = tl.cdiv(M, BLOCK_SIZE_M)
+    num_pid_n = tl.cdiv(N, BLOCK_SIZE_N)
+    num_tiles = num_pid_m * num_pid_n
+    offs_k = tl.arange(0, BLOCK_SIZE_K)
+    # each byte of B holds N_BITS trits, so the packed tile is
+    # BLOCK_SIZE_K // N_BITS bytes deep and every byte is loaded exactly once
+    tl.static_assert(N_BITS == 4)
+    offs_pk = tl.arange(0, BLOCK_SIZE_K // N_BITS)
+
+    # persistent loop: the grid is sized to the SM count and each program
+    # sweeps tiles across all batches, so the scheduler dispatches once
+    # instead of once per tile
+    for tile_id in range(start_pid, num_tiles * B, tl.num_programs(axis=0)):
+        # for the common single-batch inference case the divmod and every
+        # batch-stride pointer term constant-fold away
+        if HAS_BATCH:
+            batch_id = tile_id // num_tiles
+            pid = tile_id % num_tiles
+        else:
+            batch_id = 0
+            pid = tile_id
+        # GROUP_AXIS picks which output axis consecutive programs sweep
+        # within an L2 group: M-major suits wide outputs, N-major suits
+        # tall ones (autotuned per shape)
+        if GROUP_AXIS == 0:
+            num_pid_in_group = GROUP_SIZE_M * num_pid_n
+            group_id = pid // num_pid_in_group
+            first_pid_m = group_id * GROUP_SIZE_M
+            group_size_m = min(num_pid_m - first_pid_m, GROUP_SIZE_M)
+            pid_m = first_pid_m + (pid % group_size_m)
+            pid_n = (pid % num_pid_in_group) // group_size_m
+        else:
+            num_pid_in_group = GROUP_SIZE_M * num_pid_m
+            group_id = pid // num_pid_in_group
+            first_pid_n = group_id * GROUP_SIZE_M
+            group_size_n = min(num_pid_n - first_pid_n, GROUP_SIZE_M)
+            pid_n = first_pid_n + (pid % group_size_n)
+            pid_m = (pid % num_pid_in_group) // group_size_n
+
+        offs_am = (pid_m * BLOCK_SIZE_M + tl.arange(0, BLOCK_SIZE_M)) % M
+        offs_bn = (pid_n * BLOCK_SIZE_N + tl.arange(0, BLOCK_SIZE_N)) % N
+        a_ptrs = a_ptr + batch_id * stride_batch_a + (
+            offs_am[:, None] * stride_am + offs_k[None, :] * stride_ak
+        )
+        b_ptrs = b_ptr + batch_id * stride_batch_b + (
+            offs_pk[:, None] * stride_bk + offs_bn[None, :] * stride_bn
+        )
+
+        accumulator = tl.zeros((BLOCK_SIZE_M, BLOCK_SIZE_N), dtype=tl.int32)
+        for k in range(0, tl.cdiv(K, BLOCK_SIZE_K)):
+            a = tl.load(
+                a_ptrs, mask=offs_k[None, :] < K - k * BLOCK_SIZE_K, other=0
+            )
+            p = tl.load(
+                b_ptrs,
+                mask=(offs_pk * N_BITS)[:, None] < K - k * BLOCK_SIZE_K,
+                other=0,
+            )
+            b = _unpack_trits(tl.trans(p))
+            # int8 x int8 -> int32 rides the IMMA tensor cores and is exact,
+            # so dequantization is deferred to the epilogue
+            accumulator += tl.dot(a, tl.trans(b), out_dtype=tl.int32)
+            a_ptrs += BLOCK_SIZE_K * stride_ak
+            b_ptrs += (BLOCK_SIZE_K // N_BITS) * stride_bk
+
+        offs_cm = pid_m * BLOCK_SIZE_M + tl.arange(0, BLOCK_SIZE_M)
+        offs_cn = pid_n * BLOCK_SIZE_N + tl.arange(0, BLOCK_SIZE_N)
+        # dequantize in-register: per-row activation scale x per-column weight
+        # scale, applied once instead of a second pass over (b, m, n)
+        sa = tl.load(
+            scale_a_ptr + batch_id * M + offs_cm, mask=offs_cm < M, other=0.0
+        )
+        sw = tl.load(scale_w_ptr + offs_cn, mask=offs_cn < N, other=0.0)
+        c = (accumulator.to(tl.float32) * sa[:, None] * sw[None, :]).to(
+            c_ptr.dtype.element_ty
+        )
+        c_ptrs = c_ptr + batch_id * stride_batch_c + (
+            stride_cm * offs_cm[:, None] + stride_cn * offs_cn[None, :]
+        )
+        c_mask = (offs_cm[:, None] < M) & (offs_cn[None, :] < N)
+        tl.store(c_ptrs, c, mask=c_mask)
+
+
+def _splitk_autotune_configs():
+    """Configurations for `_ternary_bmm_splitk_kernel`.
+    Skinny-M shapes fill the GPU by splitting the reduction, so the sweep
+    varies the K split and the N tile rather than the M tile.
+    """
+    configs = []
+    for block_n, block_k, split_k in product((64, 128, 256), (64, 128), (2, 4, 8)):
+        configs.append(
+            triton.Config(
+                {
+                    "BLOCK_SIZE_M": 16,
+                    "BLOCK_SIZE_N": block_n,
+                    "BLOCK_SIZE_K": block_k,
+                    "SPLIT_K": split_k,
+                },
+                num_warps=4,
+                num_stages=2,
+            )
+        )
+    return configs
+
+
+# the kernel accumulates into c with atomic adds, so the autotuner must
+# zero the buffer between benchmark runs or the first call per shape
+# would return the sum of every timed run
+@triton.autotune(
+    configs=_splitk_autotune_configs(),
+    key=["M", "N", "K"],
+    reset_to_zero=["c_ptr"],
+)
+@triton.jit
+def _ternary_bmm_splitk_kernel(
+    a_ptr,
+    b_ptr,
+    c_ptr,
+    M,
+    N,
+    K,
+    stride_batch_a,
+    stride_am,
+    stride_ak,
+    stride_batch_b,
+    stride_bk,
+    stride_bn,
+    stride_batch_c,
+    stride_cm,
+    stride_cn,
+    scale_a_ptr,
+    scale_w_ptr,
+    N_BITS: tl.constexpr,
+    BLOCK_SIZE_M: tl.constexpr,
+    BLOCK_SIZE_N: tl.constexpr,
+    BLOCK_SIZE_K: tl.constexpr,
+    SPLIT_K: tl.constexpr,
+    HAS_BATCH: tl.constexpr,
+):
+    pid = tl.program_id(axis=0)
+    pid_k = tl.program_id(axis=1)
+    if HAS_BATCH:
+        batch_id = tl.program_id(axis=2)
+    else:
+        batch_id = 0
+    num_pid_n = tl.cdiv(N, BLOCK_SIZE_N)
+    pid_m = pid // num_pid_n
+    pid_n = pid % num_pid_n
+
+    # each of the SPLIT_K programs covers a contiguous span of K iterations
+    # and atomically adds its scaled partial sum into the fp32 output
+    num_iters = tl.cdiv(K, BLOCK_SIZE_K)
+    iters_per_split = tl.cdiv(num_iters, SPLIT_K)
+    k_start = pid_k * iters_per_split
+    k_end = tl.minimum(k_start + iters_per_split, num_iters)
+
+    offs_am = (pid_m * BLOCK_SIZE_M + tl.arange(0, BLOCK_SIZE_M)) % M
+    offs_bn = (pid_n * BLOCK_SIZE_N + tl.arange(0, BLOCK_SIZE_N)) % N
+    offs_k = tl.arange(0, BLOCK_SIZE_K)
+    tl.static_assert(N_BITS == 4)
+    offs_pk = tl.arange(0, BLOCK_SIZE_K // N_BITS)
+    a_ptrs = a_ptr + batch_id * stride_batch_a + (
+        offs_am[:, None] * stride_am
+        + (k_start * BLOCK_SIZE_K + offs_k)[None, :] * stride_ak
+    )
+    b_ptrs = b_ptr + batch_id * stride_batch_b + (
+        (k_start * (BLOCK_SIZE_K // N_BITS) + offs_pk)[:, None] * stride_bk
+        + offs_bn[None, :] * stride_bn
+    )
+
+    accumulator = tl.zeros((BLOCK_SIZE_M, BLOCK_SIZE_N), dtype=tl.int32)
+    for k in range(k_start, k_end):
+        a = tl.load(a_ptrs, mask=offs_k[None, :] < K - k * BLOCK_SIZE_K, other=0)
+        p = tl.load(
+            b_ptrs,
+            mask=(offs_pk * N_BITS)[:, None] < K - k * BLOCK_SIZE_K,
+            other=0,
+        )
+        b = _unpack_trits(tl.trans(p))
+        accumulator += tl.dot(a, tl.trans(b), out_dtype=tl.int32)
+        a_ptrs += BLOCK_SIZE_K * stride_ak
+        b_ptrs += (BLOCK_SIZE_K // N_BITS) * stride_bk
+
+    offs_cm = pid_m * BLOCK_SIZE_M + tl.arange(0, BLOCK_SIZE_M)
+    offs_cn = pid_n * BLOCK_SIZE_N + tl.arange(0, BLOCK_SIZE_N)
+    # the scales are multiplicative, so scaling each partial is equivalent
+    # to scaling the full sum
+    sa = tl.load(scale_a_ptr + batch_id * M + offs_cm, mask=offs_cm < M, other=0.0)
+    sw = tl.load(scale_w_ptr + offs_cn, mask=offs_cn < N, other=0.0)
+    partial = accumulator.to(tl.float32) * sa[:, None] * sw[None, :]
+    c_ptrs = c_ptr + batch_id * stride_batch_c + (
+        stride_cm * offs_cm[:, None] + stride_cn * offs_cn[None, :]
+    )
+    c_mask = (offs_cm[:, None] < M) & (offs_cn[None, :] < N)
+    tl.atomic_add(c_ptrs, partial, mask=c_mask)
+
+
+@triton.jit
+def _absmax_quant_kernel(a_ptr, out_ptr, scale_ptr, K, BLOCK_SIZE_K: tl.constexpr):
+    """Per-row absmax quantization to int8; one program per row."""
+    row = tl.program_id(axis=0)
+    offs = tl.arange(0, BLOCK_SIZE_K)
+    amax = 0.0
+    for k in range(0, tl.cdiv(K, BLOCK_SIZE_K)):
+        x = tl.load(
+            a_ptr + row * K + k * BLOCK_SIZE_K + offs,
+            mask=k * BLOCK_SIZE_K + offs < K,
+            other=0.0,
+        ).to(tl.float32)
+        amax = tl.maximum(amax, tl.max(tl.abs(x), axis=0))
+    scale = tl.maximum(amax, 1e-5) / 127.0
+    tl.store(scale_ptr + row, scale)
+    for k in range(0, tl.cdiv(K, BLOCK_SIZE_K)):
+        mask = k * BLOCK_SIZE_K + offs < K
+        x = tl.load(
+            a_ptr + row * K + k * BLOCK_SIZE_K + offs, mask=mask, other=0.0
+        ).to(tl.float32)
+        q = x / scale
+        # int8 conversion truncates toward zero, so bias by +-0.5 to round
+        q = tl.where(q >= 0, q + 0.5, q - 0.5)
+        q = tl.minimum(tl.maximum(q, -128.0), 127.0).to(tl.int8)
+        tl.store(out_ptr + row * K + k * BLOCK_SIZE_K + offs, q, mask=mask)
+
+
+def pack_ternary(w, int_per_2_bits=4):
+    """Pack a ternary weight into 2-bit fields of a uint8 tensor.
+    Four trits share one byte, with trit i stored at bits [2i+1:2i] as
+    0b00 -> 0, 0b01 -> +1, 0b10 -> -1 (0b11 is reserved), so the packed
+    tensor holds k // 4 bytes per column instead of k. The result is laid
+    out with n on the fast axis so the kernel's B loads coalesce.
+    Args:
+    w: a ternary weight tensor with shape [n, k], values in {-1, 0, +1}
+    Returns:
+    packed: a uint8 tensor with shape [k // int_per_2_bits, n]
+    """
+    n, k = w.shape
+    assert k % int_per_2_bits == 0
+    assert torch.all((w == -1) | (w == 0) | (w == 1)), "weight must be ternary"
+    codes = torch.where(w < 0, 2 * torch.ones_like(w), w).to(torch.uint8)
+    codes = codes.view(n, k // int_per_2_bits, int_per_2_bits)
+    shifts = torch.arange(
+        0, 2 * int_per_2_bits, 2, dtype=torch.uint8, device=w.device
+    )
+    packed = (codes << shifts).sum(dim=-1).to(torch.uint8)
+    return packed.t().contiguous()
+
+
+def batched_bitmat(a, b, scale_a=None, scale_w=None, int_per_2_bits=4):
+    """Batched matmul between int8 activations and 2-bit packed ternary weights.
+    The reduction runs entirely in int32 (W1.58A8); the activation and
+    weight scales are applied once per output element at the store epilogue,
+    so no follow-up rescaling pass over the output is needed. A floating
+    point `a` is absmax-quantized to int8 per row on the fly, in which case
+    `scale_a` must be left as None.
+    Args:
+    a: an int8 or floating point activation tensor with shape [b, m, k]
+    b: a packed weight tensor with shape [k // int_per_2_bits, n]
+    scale_a: a per-row activation scale tensor with shape [b, m]
+    scale_w: a per-column weight scale tensor with shape [n]
+    Returns:
+    c: an fp16 output tensor with shape [b, m, n]
+    """
+    assert a.is_contiguous(), "matrix A must be contiguous"
+    assert b.is_contiguous(), "matrix B must be contiguous"
+    assert scale_w is not None
+    assert a.shape[-1] == b.shape[0] * int_per_2_bits
+    B, M, K = a.shape
+    if a.dtype != torch.int8:
+        assert scale_a is None, "scale_a is computed when A is floating point"
+        a_q = torch.empty_like(a, dtype=torch.int8)
+        scale_a = torch.empty((B, M), device=a.device, dtype=torch.float32)
+        _absmax_quant_kernel[(B * M,)](
+            a,
+            a_q,
+            scale_a,
+            K,
+            BLOCK_SIZE_K=min(triton.next_power_of_2(K), 1024),
+        )
+        a = a_q
+    # both kernels index the scales flat, assuming contiguous fp32 layouts
+    assert scale_a is not None, "scale_a is required for int8 activations"
+    assert scale_a.is_contiguous(), "scale_a must be contiguous"
+    assert scale_a.dtype == torch.float32, "scale_a must be float32"
+    assert scale_a.numel() == B * M
+    assert scale_w.is_contiguous(), "scale_w must be contiguous"
+    assert scale_w.dtype == torch.float32, "scale_w must be float32"
+    assert scale_w.numel() == b.shape[1]
+    # no transpose and no expand: B is packed (k // 4, n) with n on the fast
+    # axis, and the batch broadcast is expressed as a literal zero stride
+    N = b.shape[1]
+    if M < 32:
+        # skinny decode shapes underfill the tile grid, so split the
+        # reduction across SPLIT_K programs per output tile instead
+        c = torch.zeros((B, M, N), device=a.device, dtype=torch.float32)
+        grid = lambda META: (
+            triton.cdiv(M, META["BLOCK_SIZE_M"])
+            * triton.cdiv(N, META["BLOCK_SIZE_N"]),
+            META["SPLIT_K"],
+            B,
+        )
+        _ternary_bmm_splitk_kernel[grid](
+            a,
+            b,
+            c,
+            M,
+            N,
+            K,
+            a.stride(0),
+            a.stride(1),
+            a.stride(2),
+            0,
+            b.stride(0),
+            b.stride(1),
+            c.stride(0),
+            c.stride(1),
+            c.stride(2),
+            scale_a,
+            scale_w,
+            N_BITS=int_per_2_bits,
+            HAS_BATCH=B > 1,
+        )
+        return c.to(torch.float16)
+    c = torch.empty((B, M, N), device=a.device, dtype=torch.float16)
+    num_sms = _multi_processor_count(a.get_device())
+    grid = lambda META: (
+        min(
+            num_sms,
+            triton.cdiv(M, META["BLOCK_SIZE_M"])
+            * triton.cdiv(N, META["BLOCK_SIZE_N"])
+            * B,
+        ),
+    )
+    _ternary_bmm_kernel[grid](
+        a,
+        b,
+        c,
+        B,
+        M,
+        N,
+        K,
+        a.stride(0),
+        a.stride(1),
+        a.stride(2),
+        0,
+        b.stride(0),
+        b.stride(1),
+        c.stride(0),
+        c.stride(1),
+        c.stride(2),
+        scale_a,
+        scale_w,
+        N_BITS=int_per_2_bits,
+        HAS_BATCH=B > 1,
+    )
+    return c